@@ -1,126 +1,317 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
 import sqlite3
+import threading
+import os
+import queue
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import plotly.express as px
 from PIL import Image, ImageOps
-import pytesseract
-import re
+# Receipts are OCR'd concurrently, so keep each Tesseract call on one thread
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+import tesserocr
 from datetime import datetime
 import json
+import math
+import hashlib
 from groq import Groq
 
 # --- CONFIGURATION ---
 DB_NAME = 'receipt_vault_v6.db'
 GROQ_MODEL = "llama-3.3-70b-versatile" 
+OCR_MAX_SIDE = 1600        # px; longer side is downscaled to this before OCR
+OCR_THRESHOLD = 180        # grayscale cut-off for binarization
+MAX_WORKERS = 8            # concurrent OCR / Groq jobs per batch
+CACHE_MAX_ENTRIES = 16     # per DB-version-keyed read cache; older versions are evicted
+UPLOAD_CACHE_MAX_ENTRIES = 32  # per upload-keyed image/OCR cache
+GROQ_CLIENT_MAX_ENTRIES = 4  # Groq clients kept warm, one per recent API key
+LINE_ITEM_COLUMNS = ['name', 'qty', 'price']
+# YYYY-MM bucket derived by SQLite from ISO dates; NULL for anything else
+DATE_MONTH_SQL = "CASE WHEN date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr(date, 1, 7) END"
 
 # --- DATABASE FUNCTIONS ---
+@st.cache_resource
+def get_conn():
+    """Opens the shared SQLite connection once per process and tunes it."""
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-20000;
+        PRAGMA foreign_keys=ON;
+    """)
+    return conn
+
+@st.cache_resource
+def get_db_lock():
+    """Serializes access to the shared connection across Streamlit sessions."""
+    return threading.Lock()
+
+@st.cache_resource
+def _db_version():
+    """Write counter shared by all sessions; cached reads are keyed on it."""
+    return {"value": 0}
+
+def get_db_version():
+    return _db_version()["value"]
+
+def bump_db_version():
+    _db_version()["value"] += 1
+
 def init_db():
     """Initializes the SQLite database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS receipts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    merchant TEXT,
-                    date TEXT,
-                    invoice_number TEXT,
-                    subtotal REAL,
-                    tax REAL,
-                    total_amount REAL,
-                    filename TEXT,
-                    upload_timestamp TEXT
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS line_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    receipt_id INTEGER,
-                    name TEXT,
-                    qty INTEGER,
-                    price REAL,
-                    FOREIGN KEY (receipt_id) REFERENCES receipts (id)
-                )''')
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with get_db_lock():
+        c = conn.cursor()
+        c.execute(f'''CREATE TABLE IF NOT EXISTS receipts (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        merchant TEXT,
+                        date TEXT,
+                        invoice_number TEXT,
+                        subtotal REAL,
+                        tax REAL,
+                        total_amount REAL,
+                        filename TEXT,
+                        upload_timestamp TEXT,
+                        date_month TEXT GENERATED ALWAYS AS ({DATE_MONTH_SQL}) VIRTUAL
+                    )''')
+        line_items_sql = '''CREATE TABLE IF NOT EXISTS {} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        receipt_id INTEGER,
+                        name TEXT,
+                        qty INTEGER,
+                        price REAL,
+                        FOREIGN KEY (receipt_id) REFERENCES receipts (id) ON DELETE CASCADE
+                    )'''
+        c.execute(line_items_sql.format("line_items"))
+        # SQLite cannot alter a foreign key, so vaults created before cascading
+        # deletes get line_items rebuilt once (dropping any orphaned rows)
+        fk = c.execute("PRAGMA foreign_key_list(line_items)").fetchone()
+        if fk and fk[6] != "CASCADE":
+            with conn:
+                c.execute("BEGIN")
+                c.execute(line_items_sql.format("line_items_new"))
+                c.execute("""INSERT INTO line_items_new (id, receipt_id, name, qty, price)
+                             SELECT id, receipt_id, name, qty, price FROM line_items
+                             WHERE receipt_id IN (SELECT id FROM receipts)""")
+                c.execute("DROP TABLE line_items")
+                c.execute("ALTER TABLE line_items_new RENAME TO line_items")
+        # Vaults created before date_month existed get the column added in place
+        columns = [row[1] for row in c.execute("PRAGMA table_xinfo(receipts)")]
+        if 'date_month' not in columns:
+            c.execute(f"ALTER TABLE receipts ADD COLUMN date_month TEXT GENERATED ALWAYS AS ({DATE_MONTH_SQL}) VIRTUAL")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_month ON receipts(date_month)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_dup ON receipts(merchant, date, total_amount, invoice_number)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_items_rid ON line_items(receipt_id)")
 
 def check_if_receipt_exists(merchant, date, total, invoice_num):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    query = "SELECT id FROM receipts WHERE merchant = ? AND date = ? AND total_amount = ?"
+    conn = get_conn()
+    query = "SELECT 1 FROM receipts WHERE merchant = ? AND date = ? AND total_amount = ?"
     params = [merchant, date, total]
     
     if invoice_num and invoice_num != "Unknown":
         query += " AND invoice_number = ?"
         params.append(invoice_num)
         
-    c.execute(query, tuple(params))
-    data = c.fetchall()
-    conn.close()
-    return len(data) > 0, len(data) 
-
-def save_receipt_to_db(data, filename, line_items_data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    upload_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
+    with get_db_lock():
+        c = conn.cursor()
+        c.execute("SELECT EXISTS(" + query + ")", tuple(params))
+        return bool(c.fetchone()[0])
+
+def _insert_receipt(c, data, filename, line_items_data):
+    # SQLite stamps the upload time itself (local time, as before)
     c.execute("""INSERT INTO receipts 
                  (merchant, date, invoice_number, subtotal, tax, total_amount, filename, upload_timestamp) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                 VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))""",
               (data['merchant'], data['date'], data['invoice_number'], 
-               data['subtotal'], data['tax'], data['total'], filename, upload_time))
+               data['subtotal'], data['tax'], data['total'], filename))
     
     receipt_id = c.lastrowid
-    for item in line_items_data:
-        c.execute("INSERT INTO line_items (receipt_id, name, qty, price) VALUES (?, ?, ?, ?)",
-                  (receipt_id, item['name'], item['qty'], item['price']))
-    conn.commit()
-    conn.close()
+    c.executemany("INSERT INTO line_items (receipt_id, name, qty, price) VALUES (?, ?, ?, ?)",
+                  ((receipt_id, name, qty, price) for name, qty, price in line_items_data))
     return receipt_id
 
-def get_all_receipts():
-    conn = sqlite3.connect(DB_NAME)
-    try:
-        df = pd.read_sql_query("SELECT * FROM receipts ORDER BY id DESC", conn)
-    except:
-        df = pd.DataFrame()
-    conn.close()
+def save_receipts_to_db(batch):
+    """Saves a list of (data, filename, line_items) receipts in one transaction.
+
+    line_items must already be (name, qty, price) tuples (see normalize_line_items).
+    """
+    conn = get_conn()
+    
+    with get_db_lock(), conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        receipt_ids = [_insert_receipt(c, data, filename, line_items_data)
+                       for data, filename, line_items_data in batch]
+        bump_db_version()
+    return receipt_ids
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _list_receipts_min_cached(version):
+    conn = get_conn()
+    with get_db_lock():
+        return conn.execute("SELECT id, merchant, total_amount FROM receipts ORDER BY id DESC").fetchall()
+
+def list_receipts_min():
+    """Lists (id, merchant, total_amount) tuples, newest first, without pandas."""
+    return _list_receipts_min_cached(get_db_version())
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_receipt_cached(receipt_id, version):
+    conn = get_conn()
+    with get_db_lock():
+        try:
+            df = pd.read_sql_query("SELECT * FROM receipts WHERE id = ?", conn, params=(receipt_id,))
+        except:
+            df = pd.DataFrame()
+    return df
+
+def get_receipt(receipt_id):
+    """Fetches the full row for a specific receipt ID."""
+    return _get_receipt_cached(receipt_id, get_db_version())
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_line_items_cached(receipt_id, version):
+    conn = get_conn()
+    with get_db_lock():
+        try:
+            df = pd.read_sql_query("SELECT name, qty, price FROM line_items WHERE receipt_id = ?", conn, params=(receipt_id,))
+        except:
+            df = pd.DataFrame()
     return df
 
 def get_line_items(receipt_id):
     """Fetches line items for a specific receipt ID."""
-    conn = sqlite3.connect(DB_NAME)
-    try:
-        df = pd.read_sql_query("SELECT name, qty, price FROM line_items WHERE receipt_id = ?", conn, params=(receipt_id,))
-    except:
-        df = pd.DataFrame()
-    conn.close()
-    return df
+    return _get_line_items_cached(receipt_id, get_db_version())
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_spend_by_merchant_cached(version):
+    """Total spend per merchant, largest first."""
+    conn = get_conn()
+    with get_db_lock():
+        return pd.read_sql_query("""SELECT merchant, COALESCE(SUM(total_amount), 0) AS total_amount
+                                    FROM receipts
+                                    GROUP BY merchant
+                                    ORDER BY total_amount DESC""", conn)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_monthly_spend_cached(version):
+    """Total spend per YYYY-MM month, sorted chronologically."""
+    conn = get_conn()
+    with get_db_lock():
+        return pd.read_sql_query("""SELECT date_month AS month_year, SUM(total_amount) AS total_amount
+                                    FROM receipts
+                                    WHERE date_month IS NOT NULL
+                                    GROUP BY date_month
+                                    ORDER BY date_month""", conn)
 
 def delete_receipt(receipt_id):
     """Deletes a receipt and its associated line items."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Delete line items first (Foreign Key hygiene)
-    c.execute("DELETE FROM line_items WHERE receipt_id = ?", (receipt_id,))
-    # Delete the main receipt
-    c.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,))
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with get_db_lock():
+        c = conn.cursor()
+        # Line items go with it via ON DELETE CASCADE
+        c.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,))
+        bump_db_version()
 
 def clear_database():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM line_items")
-    c.execute("DELETE FROM receipts")
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with get_db_lock(), conn:
+        c = conn.cursor()
+        c.execute("BEGIN")
+        c.execute("DELETE FROM line_items")
+        c.execute("DELETE FROM receipts")
+        bump_db_version()
 
 # --- PROCESSING FUNCTIONS ---
 def preprocess_image(image):
-    return ImageOps.grayscale(image)
+    """Grayscale, downscale and binarize so Tesseract works on fewer pixels."""
+    img = ImageOps.grayscale(image)
+    w, h = img.size
+    scale = min(1.0, OCR_MAX_SIDE / max(w, h))
+    if scale < 1.0:
+        img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+    img = ImageOps.autocontrast(img)
+    return img.point(lambda p: 255 if p > OCR_THRESHOLD else 0, mode='1')
+
+@st.cache_resource
+def get_tess_pool():
+    """Idle in-process Tesseract engines and a semaphore capping how many exist."""
+    return queue.SimpleQueue(), threading.BoundedSemaphore(MAX_WORKERS)
 
 def extract_text(image):
-    return pytesseract.image_to_string(image)
+    # An engine is not thread-safe, so each call borrows one. The semaphore limits
+    # borrowers process-wide (all sessions), and an engine is only built when none
+    # is idle, so at most MAX_WORKERS engines ever exist.
+    idle, slots = get_tess_pool()
+    with slots:
+        try:
+            api = idle.get_nowait()
+        except queue.Empty:
+            api = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.LSTM_ONLY)
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            idle.put(api)
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES)
+def preprocess_upload(file_bytes):
+    """Preprocessed OCR input for an uploaded file, cached by its content."""
+    return preprocess_image(Image.open(io.BytesIO(file_bytes)))
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES)
+def ocr_bytes(file_bytes):
+    """OCR text for an uploaded file, cached by its content."""
+    return extract_text(preprocess_upload(file_bytes))
+
+@st.cache_resource(show_spinner=False, max_entries=GROQ_CLIENT_MAX_ENTRIES)
+def get_groq(api_key):
+    """One Groq client per recent key, so its HTTP connection pool stays warm."""
+    return Groq(api_key=api_key)
+
+def parse_amount(value):
+    """Reads an LLM amount such as "$1,234.50"; None/blank give None, other junk raises ValueError."""
+    if isinstance(value, str):
+        value = value.replace('$', '').replace(',', '').strip()
+    if value is None or value == '':
+        return None
+    try:
+        amount = float(value)
+    except TypeError:
+        amount = float('nan')
+    if not math.isfinite(amount):
+        raise ValueError(f"not a number: {value!r}")
+    return amount
+
+def to_float(value):
+    """LLM amount as a float; missing values count as 0, unreadable ones raise ValueError."""
+    amount = parse_amount(value)
+    return 0.0 if amount is None else amount
+
+def normalize_line_items(raw_items):
+    """Coerces the LLM's line_items into (name, qty, price) tuples; returns (items, skipped)."""
+    items, skipped = [], 0
+    for item in raw_items if isinstance(raw_items, list) else []:
+        try:
+            name = str(item.get('name') or '').strip()
+            qty = parse_amount(item.get('qty'))
+            price = parse_amount(item.get('price'))
+            qty = 1 if qty is None else int(qty)
+        except (AttributeError, ValueError):
+            skipped += 1
+            continue
+        if not name or price is None:
+            skipped += 1
+            continue
+        items.append((name, qty, price))
+    return items, skipped
 
 def parse_with_groq(raw_text, api_key):
-    client = Groq(api_key=api_key)
+    client = get_groq(api_key)
     prompt = f"""
     Extract structured data from this receipt text. 
     Return ONLY a JSON object with these keys: 
@@ -133,18 +324,61 @@ def parse_with_groq(raw_text, api_key):
     Text:
     {raw_text}
     """
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model=GROQ_MODEL,
-            response_format={"type": "json_object"}
-        )
-        return json.loads(chat_completion.choices[0].message.content)
-    except Exception as e:
-        st.error(f"Groq Parsing Error: {e}")
-        return None
+    chat_completion = client.chat.completions.create(
+        messages=[{"role": "user", "content": prompt}],
+        model=GROQ_MODEL,
+        response_format={"type": "json_object"}
+    )
+    return json.loads(chat_completion.choices[0].message.content)
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES)
+def _parse_with_groq_cached(text_hash, api_key_fp, _raw_text, _api_key):
+    return parse_with_groq(_raw_text, _api_key)
+
+def parse_with_groq_cached(raw_text, api_key):
+    """parse_with_groq memoized on the OCR text, partitioned per API key."""
+    text_hash = hashlib.blake2b(raw_text.encode(), digest_size=16).hexdigest()
+    # Fingerprint only, so the key itself never becomes part of a cache key
+    api_key_fp = hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest()
+    return _parse_with_groq_cached(text_hash, api_key_fp, raw_text, api_key)
+
+def process_batch(files_bytes, api_key):
+    """Runs OCR and Groq parsing for several uploaded files concurrently.
+
+    tesserocr releases the GIL while recognizing and the Groq call is
+    network-bound, so threads overlap both. Each image's parse is queued
+    as soon as its OCR finishes. Returns the parsed dict, or the exception raised, per file
+    in input order (worker threads cannot draw Streamlit elements).
+    """
+    results = [None] * len(files_bytes)
+    # Workers run under this script's context so the cached helpers can find it
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(files_bytes)),
+                            initializer=add_script_run_ctx,
+                            initargs=(None, get_script_run_ctx())) as ex:
+        ocr_futs = {ex.submit(ocr_bytes, file_bytes): i for i, file_bytes in enumerate(files_bytes)}
+        parse_futs = {}
+        for fut in as_completed(ocr_futs):
+            i = ocr_futs[fut]
+            try:
+                parse_futs[ex.submit(parse_with_groq_cached, fut.result(), api_key)] = i
+            except Exception as e:
+                results[i] = e
+        for fut in as_completed(parse_futs):
+            i = parse_futs[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                results[i] = e
+    return results
 
 # --- VALIDATION LOGIC ---
+def is_same_receipt(data, other):
+    """Applies the check_if_receipt_exists rule to two unsaved receipts."""
+    if (data['merchant'], data['date'], data['total']) != (other['merchant'], other['date'], other['total']):
+        return False
+    invoice_num = data['invoice_number']
+    return not invoice_num or invoice_num == "Unknown" or invoice_num == other['invoice_number']
+
 def validate_receipt(data, is_dup_bool):
     results = {}
     sub = data.get('subtotal', 0)
@@ -183,6 +417,27 @@ def validate_receipt(data, is_dup_bool):
 
     return results
 
+# --- ANALYTICS CHARTS ---
+# Figures are cached per DB write version, so tab switches and widget
+# reruns reuse the built Plotly spec until the vault changes.
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def build_vendor_bar(version):
+    return px.bar(_get_spend_by_merchant_cached(version), x='merchant', y='total_amount', color='merchant', title="Spending per Vendor")
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def build_spend_pie(version):
+    return px.pie(_get_spend_by_merchant_cached(version), values='total_amount', names='merchant', title="Spend Distribution")
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def build_monthly_line(version):
+    """Monthly trend figure, or None when no receipt has a usable date."""
+    monthly_spend = _get_monthly_spend_cached(version)
+    if monthly_spend.empty:
+        return None
+    return px.line(monthly_spend, x='month_year', y='total_amount', markers=True, 
+                   title="Total Spending Over Time",
+                   labels={'month_year': 'Month', 'total_amount': 'Amount ($)'})
+
 # --- MAIN APP ---
 def main():
     st.set_page_config(page_title="Receipt Vault & Validator", layout="wide", page_icon="🧾")
@@ -190,7 +445,7 @@ def main():
 
     # Session State
     if 'current_receipt' not in st.session_state: st.session_state['current_receipt'] = None
-    if 'current_line_items' not in st.session_state: st.session_state['current_line_items'] = []
+    if 'current_line_items_df' not in st.session_state: st.session_state['current_line_items_df'] = pd.DataFrame(columns=LINE_ITEM_COLUMNS)
     if 'validation_status' not in st.session_state: st.session_state['validation_status'] = None
 
     # --- SIDEBAR ---
@@ -216,18 +471,19 @@ def main():
     with tab_vault:
         st.markdown("### 1. Document Ingestion")
         
-        uploaded_file = st.file_uploader("Upload Receipt", type=["png", "jpg", "jpeg"])
+        uploaded_files = st.file_uploader("Upload Receipts", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
         
-        if uploaded_file:
-            image = Image.open(uploaded_file)
-            cleaned_image = preprocess_image(image)
+        if uploaded_files:
+            files_bytes = [uploaded_file.getvalue() for uploaded_file in uploaded_files]
 
             st.subheader("Image Processing")
-            col_img1, col_img2 = st.columns(2)
-            with col_img1:
-                st.image(image, caption="Original Receipt", use_container_width=True)
-            with col_img2:
-                st.image(cleaned_image, caption="Cleaned (Grayscale) for OCR", use_container_width=True)
+            for uploaded_file, file_bytes in zip(uploaded_files, files_bytes):
+                with st.expander(uploaded_file.name, expanded=len(uploaded_files) == 1):
+                    col_img1, col_img2 = st.columns(2)
+                    with col_img1:
+                        st.image(file_bytes, caption="Original Receipt", use_container_width=True)
+                    with col_img2:
+                        st.image(preprocess_upload(file_bytes), caption="Cleaned (Binarized) for OCR", use_container_width=True)
 
             st.divider()
 
@@ -236,40 +492,58 @@ def main():
                     st.error("Please enter your Groq API Key in the sidebar first.")
                 else:
                     with st.spinner("Running OCR & Groq AI Analysis..."):
-                        raw_text = extract_text(cleaned_image)
-                        structured_data = parse_with_groq(raw_text, user_groq_key)
-                        
-                        if structured_data:
-                            receipt_data = {
-                                "merchant": structured_data.get('merchant', 'Unknown'),
-                                "date": structured_data.get('date', datetime.now().strftime("%Y-%m-%d")),
-                                "invoice_number": structured_data.get('invoice_number', 'Unknown'),
-                                "subtotal": float(structured_data.get('subtotal', 0)),
-                                "tax": float(structured_data.get('tax', 0)),
-                                "total": float(structured_data.get('total', 0))
-                            }
-                            line_items = structured_data.get('line_items', [])
-                            
-                            st.session_state['current_receipt'] = receipt_data
-                            st.session_state['current_line_items'] = line_items
+                        results = process_batch(files_bytes, user_groq_key)
+
+                    batch = []
+                    checks = []
+                    for uploaded_file, structured_data in zip(uploaded_files, results):
+                        if isinstance(structured_data, Exception):
+                            st.error(f"Processing Error ({uploaded_file.name}): {structured_data}")
+                        elif structured_data:
+                            try:
+                                receipt_data = {
+                                    "merchant": structured_data.get('merchant', 'Unknown'),
+                                    "date": structured_data.get('date', datetime.now().strftime("%Y-%m-%d")),
+                                    "invoice_number": structured_data.get('invoice_number', 'Unknown'),
+                                    "subtotal": to_float(structured_data.get('subtotal')),
+                                    "tax": to_float(structured_data.get('tax')),
+                                    "total": to_float(structured_data.get('total'))
+                                }
+                            except ValueError as e:
+                                st.error(f"Unreadable amount in {uploaded_file.name}: {e}")
+                                continue
+                            line_items, skipped = normalize_line_items(structured_data.get('line_items'))
+                            if skipped:
+                                st.warning(f"{uploaded_file.name}: skipped {skipped} malformed line item(s).")
                             
-                            is_dup, _ = check_if_receipt_exists(
+                            # Also flag repeats within this upload batch, which is not in the DB yet
+                            is_dup = check_if_receipt_exists(
                                 receipt_data['merchant'], receipt_data['date'], 
                                 receipt_data['total'], receipt_data['invoice_number']
-                            )
+                            ) or any(is_same_receipt(receipt_data, prev) for prev, _, _ in batch)
                             val_results = validate_receipt(receipt_data, is_dup)
-                            st.session_state['validation_status'] = val_results
                             
-                            save_receipt_to_db(receipt_data, uploaded_file.name, line_items)
-                            st.success(f"Processing Complete! Added to Vault.")
+                            # The validation tab shows the last receipt of the batch
+                            st.session_state['current_receipt'] = receipt_data
+                            st.session_state['current_line_items_df'] = pd.DataFrame(line_items, columns=LINE_ITEM_COLUMNS)
+                            st.session_state['validation_status'] = val_results
                             
-                            st.markdown("#### Quick Validation Check")
+                            batch.append((receipt_data, uploaded_file.name, line_items))
+                            checks.append((uploaded_file.name, val_results))
+                        else:
+                            st.error(f"AI could not parse {uploaded_file.name}.")
+
+                    if batch:
+                        save_receipts_to_db(batch)
+                        st.success(f"Processing Complete! Added {len(batch)} receipt(s) to Vault.")
+                        
+                        st.markdown("#### Quick Validation Check")
+                        for filename, val_results in checks:
+                            st.caption(filename)
                             v1, v2, v3 = st.columns(3)
                             v1.metric("Math Check", "Pass" if val_results['math'][0] else "Fail")
                             v2.metric("Duplicate", "None" if val_results['dup'][0] else "Found")
                             v3.metric("Tax Rate", "OK" if val_results['tax_rate'][0] else "Suspicious")
-                        else:
-                            st.error("AI could not parse the receipt.")
 
     # === TAB 2: DETAILED VALIDATION ===
     with tab_validation:
@@ -277,7 +551,7 @@ def main():
         
         if st.session_state['current_receipt']:
             data = st.session_state['current_receipt']
-            items = st.session_state['current_line_items']
+            items_df = st.session_state['current_line_items_df']
             val = st.session_state['validation_status']
             
             c_extract, c_validate, c_db = st.columns(3)
@@ -297,8 +571,8 @@ def main():
                     st.text_input("Total", value=f"{data.get('total', 0):.2f}", disabled=True)
                     
                     st.markdown("**Line Items:**")
-                    if items:
-                        st.dataframe(pd.DataFrame(items), hide_index=True, height=150)
+                    if not items_df.empty:
+                        st.dataframe(items_df, hide_index=True, height=150)
 
             with c_validate:
                 st.info("🔹 Validation Logic")
@@ -318,10 +592,10 @@ def main():
 
             with c_db:
                 st.info("🔹 Vault Status")
-                df_all = get_all_receipts()
-                if not df_all.empty:
-                    st.metric("Total Vault Entries", len(df_all))
-                    st.dataframe(df_all[['id', 'merchant', 'total_amount']].head(10), hide_index=True)
+                receipts = list_receipts_min()
+                if receipts:
+                    st.metric("Total Vault Entries", len(receipts))
+                    st.dataframe(pd.DataFrame(receipts[:10], columns=['id', 'merchant', 'total_amount']), hide_index=True)
         else:
             st.warning("Please upload a document first.")
 
@@ -329,22 +603,17 @@ def main():
     with tab_history:
         st.header("📜 Detailed Bill History & Management")
         
-        df_history = get_all_receipts()
+        receipts = list_receipts_min()
         
-        if not df_history.empty:
+        if receipts:
             # Layout: Left for Selection, Right for Details
             col_list, col_detail = st.columns([1, 2])
             
             with col_list:
                 st.subheader("Select Bill")
-                bill_id_list = df_history['id'].tolist()
-                
                 # Create a label for the dropdown including merchant and amount
-                df_history['label'] = df_history.apply(lambda x: f"ID: {x['id']} - {x['merchant']} (${x['total_amount']})", axis=1)
-                selected_label = st.selectbox("Choose a Receipt to View/Manage:", df_history['label'])
-                
-                # Extract ID from selection
-                selected_id = int(selected_label.split(" - ")[0].replace("ID: ", ""))
+                labels = {receipt_id: f"ID: {receipt_id} - {merchant} (${total})" for receipt_id, merchant, total in receipts}
+                selected_id = st.selectbox("Choose a Receipt to View/Manage:", list(labels), format_func=labels.get)
                 
                 st.divider()
                 st.markdown("### Delete Bill")
@@ -357,7 +626,7 @@ def main():
                 st.subheader("Bill Details")
                 
                 # Get specific row data
-                selected_row = df_history[df_history['id'] == selected_id].iloc[0]
+                selected_row = get_receipt(selected_id).iloc[0]
                 
                 # Display High Level Info
                 with st.container(border=True):
@@ -383,10 +652,9 @@ def main():
     # === TAB 4: ANALYTICS (UPDATED) ===
     with tab_analytics:
         st.subheader("Spend Analytics")
-        df = get_all_receipts()
         
-        if not df.empty:
-            df['total_amount'] = pd.to_numeric(df['total_amount'], errors='coerce').fillna(0)
+        if list_receipts_min():
+            version = get_db_version()
             
             # 1. Spending per Vendor (Bar)
             # 2. Spend Distribution (Pie)
@@ -394,31 +662,18 @@ def main():
             
             col_a, col_b = st.columns(2)
             with col_a:
-                fig = px.bar(df, x='merchant', y='total_amount', color='merchant', title="Spending per Vendor")
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(build_vendor_bar(version), use_container_width=True)
             with col_b:
-                fig2 = px.pie(df, values='total_amount', names='merchant', title="Spend Distribution")
-                st.plotly_chart(fig2, use_container_width=True)
+                st.plotly_chart(build_spend_pie(version), use_container_width=True)
             
             st.divider()
             
             # Process Date for Monthly Graph
             try:
-                # 
-                df['date_obj'] = pd.to_datetime(df['date'], errors='coerce')
-                # Remove invalid dates
-                df_time = df.dropna(subset=['date_obj']).copy()
-                df_time['month_year'] = df_time['date_obj'].dt.strftime('%Y-%m')
-                
-                # Group by Month
-                monthly_spend = df_time.groupby('month_year')['total_amount'].sum().reset_index()
-                monthly_spend = monthly_spend.sort_values('month_year')
+                fig3 = build_monthly_line(version)
 
                 st.subheader("📅 Monthly Spending Trend")
-                if not monthly_spend.empty:
-                    fig3 = px.line(monthly_spend, x='month_year', y='total_amount', markers=True, 
-                                   title="Total Spending Over Time",
-                                   labels={'month_year': 'Month', 'total_amount': 'Amount ($)'})
+                if fig3 is not None:
                     st.plotly_chart(fig3, use_container_width=True)
                 else:
                     st.warning("Dates provided in receipts are not valid for time-series analysis.")
@@ -1,161 +1,379 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
+import pyarrow as pa
+import numpy as np
 import sqlite3
+import threading
+import queue
+import os
+import io
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import plotly.express as px
 from PIL import Image, ImageOps
-import pytesseract
+# Tesseract's OpenMP threading scales badly; parallelize across pages instead
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+import tesserocr
 import re
 from datetime import datetime
 from pdf2image import convert_from_bytes
 
 DB_NAME = 'receipt_vault1.db'
+OCR_MAX_SIDE = 2000  # px; larger scans are downscaled before OCR
+OCR_MAX_WORKERS = 4  # pages OCR'd concurrently
+PDF_DPI = 200
+CACHE_MAX_ENTRIES = 16  # per version-keyed read cache; older versions are evicted
+UPLOAD_CACHE_MAX_ENTRIES = 32  # per upload-keyed preview/OCR cache
+RECEIPTS_SCHEMA = pa.schema([("id", pa.int64()), ("merchant", pa.string()), ("date", pa.string()),
+                             ("total", pa.float64()), ("tax", pa.float64())])
+
+# Parsing patterns, compiled once at import
+_DATE_RE = re.compile(r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2})')
+# Every tax/total in a line (lastgroup says which); item prices are matched separately
+_AMOUNT_RE = re.compile(r'(?P<tax>(?:Tax|VAT|GST|Sales\s*Tax)[\s:$]*(?P<tax_amount>[\d,]+\.\d{2}))'
+                        r'|(?P<total>(?:Total|Amount|Due|Balance|Grand Total)[\s:$]*(?P<total_amount>[\d,]+\.\d{2}))',
+                        re.IGNORECASE)
+_PRICE_RE = re.compile(r'[\s$]([\d,]+\.\d{2})\s*$')
+# A label ending its line ("TOTAL") takes the amount that starts the next one
+_LABEL_END_RE = re.compile(r'(?:(?P<tax>Tax|VAT|GST|Sales\s*Tax)|(?P<total>Total|Amount|Due|Balance|Grand Total))[\s:$]*$',
+                           re.IGNORECASE)
+_LEAD_AMOUNT_RE = re.compile(r'^[\s:$]*([\d,]+\.\d{2})')
+_QTY_RE = re.compile(r'^(\d+)\s*[xX]\s*')
 
 # --- DATABASE FUNCTIONS ---
+@st.cache_resource
+def get_conn():
+    """Opens the shared SQLite connection once per process and tunes it."""
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+    """)
+    return conn
+
+@st.cache_resource
+def get_db_lock():
+    """Serializes access to the shared connection across Streamlit sessions."""
+    return threading.Lock()
+
+@st.cache_resource
+def _vault_version():
+    """Write counter shared by all sessions; cached reads are keyed on it."""
+    return {"value": 0}
+
+def get_vault_version():
+    return _vault_version()["value"]
+
+def bump_vault_version():
+    _vault_version()["value"] += 1
+
+@st.cache_resource
+def _dup_index_state():
+    """Set once the vault is found to hold duplicates from before uq_receipts_dup existed."""
+    return {"legacy_duplicates": False}
+
+def vault_has_legacy_duplicates():
+    return _dup_index_state()["legacy_duplicates"]
+
 def init_db():
     """Initializes the SQLite database with necessary tables."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Added tax_amount to the schema
-    c.execute('''CREATE TABLE IF NOT EXISTS receipts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    merchant TEXT,
-                    date TEXT,
-                    total_amount REAL,
-                    tax_amount REAL,
-                    filename TEXT,
-                    upload_timestamp TEXT
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS line_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    receipt_id INTEGER,
-                    name TEXT,
-                    qty INTEGER,
-                    price REAL,
-                    FOREIGN KEY (receipt_id) REFERENCES receipts (id)
-                )''')
-    conn.commit()
-    conn.close()
-
-def check_if_receipt_exists(merchant, date, total):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT id FROM receipts WHERE merchant = ? AND date = ? AND total_amount = ?", 
-              (merchant, date, total))
-    data = c.fetchone()
-    conn.close()
-    return data is not None
-
-def save_receipt_to_db(merchant, date, total, tax, filename, line_items_data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    upload_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    # Insert with Tax
-    c.execute("INSERT INTO receipts (merchant, date, total_amount, tax_amount, filename, upload_timestamp) VALUES (?, ?, ?, ?, ?, ?)",
-              (merchant, date, total, tax, filename, upload_time))
-    receipt_id = c.lastrowid
-    for item in line_items_data:
-        c.execute("INSERT INTO line_items (receipt_id, name, qty, price) VALUES (?, ?, ?, ?)",
-                  (receipt_id, item['name'], item['qty'], item['price']))
-    conn.commit()
-    conn.close()
-    return True
+    conn = get_conn()
+    with get_db_lock():
+        c = conn.cursor()
+        # Added tax_amount to the schema
+        c.execute('''CREATE TABLE IF NOT EXISTS receipts (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        merchant TEXT,
+                        date TEXT,
+                        total_amount REAL,
+                        tax_amount REAL,
+                        filename TEXT,
+                        upload_timestamp TEXT DEFAULT (datetime('now', 'localtime')),
+                        file_hash TEXT
+                    )''')
+        if "file_hash" not in {row[1] for row in c.execute("PRAGMA table_info(receipts)")}:
+            c.execute("ALTER TABLE receipts ADD COLUMN file_hash TEXT")
+        c.execute('''CREATE TABLE IF NOT EXISTS line_items (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        receipt_id INTEGER,
+                        name TEXT,
+                        qty INTEGER,
+                        price REAL,
+                        FOREIGN KEY (receipt_id) REFERENCES receipts (id)
+                    )''')
+        # Duplicates are rejected by a unique index. A vault that already holds some keeps
+        # the plain index and its rows; save_receipt_to_db checks for duplicates either way.
+        state = _dup_index_state()
+        has_unique = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_receipts_dup'").fetchone()
+        if not has_unique and not state["legacy_duplicates"]:
+            try:
+                c.execute("CREATE UNIQUE INDEX uq_receipts_dup ON receipts(merchant, date, total_amount)")
+                c.execute("DROP INDEX IF EXISTS idx_receipts_dup")
+            except sqlite3.IntegrityError:
+                state["legacy_duplicates"] = True
+        if state["legacy_duplicates"]:
+            c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_dup ON receipts(merchant, date, total_amount)")
+        # Byte-identical re-uploads are rejected even if OCR would read them differently
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_receipts_file ON receipts(file_hash)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_date ON receipts(date)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_receipts_upload ON receipts(upload_timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_line_items_receipt ON line_items(receipt_id)")
+
+def save_receipt_to_db(merchant, date, total, tax, filename, line_items_data, file_hash=None):
+    """Inserts a receipt and its items; returns (inserted, receipt_id), (False, None) for a duplicate."""
+    conn = get_conn()
+    with get_db_lock(), conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        # Insert with Tax; SQLite stamps the upload time (explicitly, as older tables lack the default).
+        # NOT EXISTS covers vaults still on the non-unique index; ON CONFLICT covers file_hash.
+        c.execute("INSERT INTO receipts (merchant, date, total_amount, tax_amount, filename, upload_timestamp, file_hash) "
+                  "SELECT ?, ?, ?, ?, ?, datetime('now', 'localtime'), ? "
+                  "WHERE NOT EXISTS (SELECT 1 FROM receipts WHERE merchant = ? AND date = ? AND total_amount = ?) "
+                  "ON CONFLICT DO NOTHING",
+                  (merchant, date, total, tax, filename, file_hash, merchant, date, total))
+        if c.rowcount == 0:
+            return False, None
+        receipt_id = c.lastrowid
+        c.executemany("INSERT INTO line_items (receipt_id, name, qty, price) VALUES (?, ?, ?, ?)",
+                      ((receipt_id, name, qty, price) for name, qty, price in line_items_data))
+        bump_vault_version()
+    return True, receipt_id
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_all_receipts_cached(version):
+    """Receipt list as an Arrow table, which st.dataframe renders without a pandas round trip."""
+    conn = get_conn()
+    with get_db_lock():
+        # Fetch tax as well
+        rows = conn.execute("SELECT id, merchant, date, total_amount AS total, tax_amount as tax FROM receipts ORDER BY id DESC").fetchall()
+    columns = list(zip(*rows)) if rows else [[] for _ in RECEIPTS_SCHEMA]
+    return pa.table(columns, schema=RECEIPTS_SCHEMA)
 
 def get_all_receipts():
-    conn = sqlite3.connect(DB_NAME)
-    # Fetch tax as well
-    df = pd.read_sql_query("SELECT id, merchant, date, total_amount AS total, tax_amount as tax FROM receipts ORDER BY id DESC", conn)
-    conn.close()
-    return df
+    return _get_all_receipts_cached(get_vault_version())
 
-def get_detailed_bill_data(receipt_id):
-    conn = sqlite3.connect(DB_NAME)
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_detailed_bill_data_cached(version, receipt_id):
+    conn = get_conn()
     query = """
         SELECT 
             r.id as "Bill ID",
             r.merchant as "Vendor Name",
             l.name as "Item Name",
             l.qty as "Quantity",
-            l.price as "Unit Price"
+            l.price as "Unit Price",
+            (l.qty * l.price) as "Total Price"
         FROM line_items l
         JOIN receipts r ON l.receipt_id = r.id
         WHERE r.id = ?
     """
-    df = pd.read_sql_query(query, conn, params=(receipt_id,))
-    conn.close()
+    with get_db_lock():
+        df = pd.read_sql_query(query, conn, params=(receipt_id,))
     return df
 
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_bill_items_table_cached(version, receipt_id):
+    items_df = _get_detailed_bill_data_cached(version, receipt_id)
+    if items_df.empty:
+        return items_df
+    return items_df.assign(**{'S.No': np.arange(1, len(items_df) + 1, dtype=np.int32)})[
+        ['S.No', 'Bill ID', 'Vendor Name', 'Item Name', 'Quantity', 'Unit Price', 'Total Price']]
+
+def get_bill_items_table(receipt_id):
+    """Bill line items with an S.No column"""
+    return _get_bill_items_table_cached(get_vault_version(), receipt_id)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_subtotal_cached(version, receipt_id):
+    conn = get_conn()
+    with get_db_lock():
+        row = conn.execute("SELECT COALESCE(SUM(qty * price), 0) FROM line_items WHERE receipt_id = ?",
+                           (receipt_id,)).fetchone()
+    return float(row[0])
+
+def get_subtotal(receipt_id):
+    """Sum of qty * price over a receipt's line items"""
+    return _get_subtotal_cached(get_vault_version(), receipt_id)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_receipt_metadata_cached(version, receipt_id):
+    conn = get_conn()
+    with get_db_lock():
+        c = conn.cursor()
+        c.execute("SELECT total_amount, tax_amount FROM receipts WHERE id = ?", (receipt_id,))
+        data = c.fetchone()
+    return data if data else (0.0, 0.0)
+
 def get_receipt_metadata(receipt_id):
     """Helper to get totals and tax for a specific ID for validation"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT total_amount, tax_amount FROM receipts WHERE id = ?", (receipt_id,))
-    data = c.fetchone()
-    conn.close()
-    return data if data else (0.0, 0.0)
+    return _get_receipt_metadata_cached(get_vault_version(), receipt_id)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_daily_spend_cached(version):
+    conn = get_conn()
+    with get_db_lock():
+        df = pd.read_sql_query("SELECT date, COALESCE(SUM(total_amount), 0) AS total FROM receipts GROUP BY date ORDER BY date", conn)
+    # Dates are stored as OCR'd, in mixed formats: parse each one on its own, then
+    # re-sum days that were spelled differently
+    df['date'] = pd.to_datetime(df['date'], errors='coerce', format='mixed')
+    return df.dropna(subset=['date']).groupby('date', as_index=False)['total'].sum()
+
+def get_daily_spend():
+    """Total spend per receipt date, oldest first"""
+    return _get_daily_spend_cached(get_vault_version())
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _get_spend_by_merchant_cached(version):
+    conn = get_conn()
+    with get_db_lock():
+        df = pd.read_sql_query("SELECT merchant, COALESCE(SUM(total_amount), 0) AS total FROM receipts GROUP BY merchant", conn)
+    return df
+
+def get_spend_by_merchant():
+    """Total spend per merchant"""
+    return _get_spend_by_merchant_cached(get_vault_version())
 
 def clear_database():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DROP TABLE IF EXISTS line_items")
-    c.execute("DROP TABLE IF EXISTS receipts")
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with get_db_lock(), conn:
+        c = conn.cursor()
+        c.execute("BEGIN")
+        c.execute("DROP TABLE IF EXISTS line_items")
+        c.execute("DROP TABLE IF EXISTS receipts")
+        bump_vault_version()
+    _dup_index_state()["legacy_duplicates"] = False
     init_db() # Re-init immediately
 
 # --- PROCESSING & PARSING FUNCTIONS ---
-def preprocess_image(image):
-    return ImageOps.grayscale(image)
+def otsu_threshold(image):
+    """Gray level that best separates ink from paper (Otsu's method)."""
+    hist = image.histogram()
+    total = sum(hist)
+    sum_all = sum(i * count for i, count in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best_level, best_variance = 0, 0.0
+    for level, count in enumerate(hist):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
 
-def extract_text(image):
-    return pytesseract.image_to_string(image)
+def preprocess_image(image):
+    """Returns a grayscale, size-capped, binarized copy for OCR; the input is untouched."""
+    image = image.convert('L')
+    w, h = image.size
+    scale = min(1.0, OCR_MAX_SIDE / max(w, h))
+    if scale < 1.0:
+        image = image.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+    image = ImageOps.autocontrast(image)
+    threshold = otsu_threshold(image)
+    return image.point(lambda p: 255 if p > threshold else 0, mode='1')
 
-def parse_receipt_data(text):
-    data = {"merchant": "Unknown", "date": None, "total": 0.0, "tax": 0.0}
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    if lines:
-        data["merchant"] = lines[0]
-
-    date_match = re.search(r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2})', text)
-    if date_match:
-        data["date"] = date_match.group(0)
-    else:
-        data["date"] = datetime.now().strftime("%Y-%m-%d")
+@st.cache_resource
+def get_tess_pool():
+    """Idle in-process Tesseract engines and a semaphore capping how many exist."""
+    return queue.SimpleQueue(), threading.BoundedSemaphore(OCR_MAX_WORKERS)
 
-    # Extract Total
-    amount_match = re.findall(r'(?i)(?:Total|Amount|Due|Balance|Grand Total)[\s:$]*([\d,]+\.\d{2})', text)
-    if amount_match:
+def extract_text(image):
+    # Engines are not thread-safe: each call borrows one while holding a slot.
+    # Slots are shared by every session and new engines are only built when the
+    # idle queue is empty, so no more than OCR_MAX_WORKERS are ever created.
+    idle, slots = get_tess_pool()
+    with slots:
         try:
-            # Usually the last amount found is the total
-            data["total"] = float(amount_match[-1].replace(',', ''))
-        except:
-            pass
-
-    # Extract Tax (New Logic)
-    # Looks for Tax, VAT, GST followed by a number
-    tax_match = re.findall(r'(?i)(?:Tax|VAT|GST|Sales\s*Tax)[\s:$]*([\d,]+\.\d{2})', text)
-    if tax_match:
+            api = idle.get_nowait()
+        except queue.Empty:
+            api = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.AUTO)
         try:
-            # We take the largest value found associated with tax, or the last one. 
-            # Often receipts have sub-taxes, but usually the summary line is near the bottom.
-            taxes = [float(t.replace(',', '')) for t in tax_match]
-            data["tax"] = max(taxes) if taxes else 0.0
-        except:
-            pass
-            
-    return data
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            idle.put(api)
+
+def extract_pages_text(pages):
+    """Preprocesses and OCRs each page on a thread pool; returns the joined text."""
+    if len(pages) == 1:
+        return extract_text(preprocess_image(pages[0]))
+    # Workers run under this script's context so the cached OCR pool can find it
+    with ThreadPoolExecutor(max_workers=min(OCR_MAX_WORKERS, len(pages)),
+                            initializer=add_script_run_ctx,
+                            initargs=(None, get_script_run_ctx())) as ex:
+        return "\n".join(ex.map(lambda page: extract_text(preprocess_image(page)), pages))
+
+def load_pages(file_bytes, mime, page_count=1):
+    """Decodes an upload into PIL pages; PDFs are rasterized up to page_count."""
+    if mime == "application/pdf":
+        return convert_from_bytes(file_bytes, first_page=1, last_page=page_count,
+                                  dpi=PDF_DPI, fmt='jpeg', thread_count=2)
+    return [Image.open(io.BytesIO(file_bytes))]
 
-def parse_line_items_data(text):
+def hash_bytes(file_bytes):
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES)
+def preview_cached(file_hash, _file_bytes, mime):
+    """Preprocessed first page for display, or None if nothing could be decoded."""
+    pages = load_pages(_file_bytes, mime)
+    return preprocess_image(pages[0]) if pages else None
+
+def parse_all(text):
+    """Extracts header fields and line items from OCR text in a single pass over its lines."""
+    data = {"merchant": "Unknown", "date": None, "total": 0.0, "tax": 0.0}
     items = []
-    # Regex checks for price at end of line
-    price_pattern = r'[\s$]([\d,]+\.\d{2})\s*$'
-    
+    totals = []
+    taxes = []
+    first_line = True
+    pending_label = None
+
     for line in text.split('\n'):
         line = line.strip()
-        price_match = re.search(price_pattern, line)
+        if not line:
+            continue
+        if first_line:
+            data["merchant"] = line
+            first_line = False
+
+        if data["date"] is None:
+            date_match = _DATE_RE.search(line)
+            if date_match:
+                data["date"] = date_match.group(0)
+
+        if pending_label:
+            lead_match = _LEAD_AMOUNT_RE.match(line)
+            if lead_match:
+                (taxes if pending_label == "tax" else totals).append(lead_match.group(1))
+                pending_label = None
+            elif line.strip(':$ \t'):
+                pending_label = None
+        if not line[-1].isdigit():
+            label_match = _LABEL_END_RE.search(line)
+            if label_match:
+                pending_label = label_match.lastgroup
+
+        # Every amount ends in ".dd", so lines without a dot never reach the regexes
+        if '.' not in line:
+            continue
+        for match in _AMOUNT_RE.finditer(line):
+            if match.lastgroup == "total":
+                totals.append(match.group("total_amount"))
+            else:
+                taxes.append(match.group("tax_amount"))
+
+        price_match = _PRICE_RE.search(line)
         if price_match:
-            price_str = price_match.group(1)
             try:
-                price = float(price_str.replace(',', ''))
+                price = float(price_match.group(1).replace(',', ''))
                 name_part = line[:price_match.start()].strip()
                 
                 # Basic logic to skip lines that are likely totals or dates
@@ -164,7 +382,7 @@ def parse_line_items_data(text):
 
                 qty = 1
                 # Check for "2 x Burger" format
-                qty_match = re.match(r'^(\d+)\s*[xX]\s*', name_part)
+                qty_match = _QTY_RE.match(name_part)
                 if qty_match:
                     qty = int(qty_match.group(1))
                     name = name_part[qty_match.end():].strip()
@@ -172,10 +390,27 @@ def parse_line_items_data(text):
                     name = name_part
                 
                 if name:
-                    items.append({"name": name, "qty": qty, "price": price})
+                    items.append((name, qty, price))
             except ValueError:
                 continue
-    return items
+
+    if data["date"] is None:
+        data["date"] = datetime.now().strftime("%Y-%m-%d")
+    # Usually the last amount found is the total
+    if totals:
+        data["total"] = float(totals[-1].replace(',', ''))
+    # Receipts may list sub-taxes; the summary line is the largest
+    if taxes:
+        data["tax"] = max(float(t.replace(',', '')) for t in taxes)
+
+    return data, items
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES)
+def process_upload_cached(file_hash, _file_bytes, mime, page_count=1):
+    """OCR + parse for an upload, keyed by its content hash so re-uploads skip Tesseract."""
+    raw_text = extract_pages_text(load_pages(_file_bytes, mime, page_count))
+    receipt_data, line_items = parse_all(raw_text)
+    return raw_text, receipt_data, line_items
 
 # --- MAIN APP ---
 def main():
@@ -187,6 +422,9 @@ def main():
         api_key = st.text_input("General API Key", type="password") 
         st.divider()
         st.warning("Database Schema Updated. If you see errors, clear records.")
+        if vault_has_legacy_duplicates():
+            st.info("This vault holds duplicate receipts saved before duplicate checks were enforced. "
+                    "They are kept as-is; new duplicates are still rejected.")
         if st.button("Clear All Records"):
             clear_database()
             st.toast("All records and tables reset!", icon="🗑️")
@@ -198,6 +436,9 @@ def main():
     with col_header_2:
         st.title("Receipt Vault & Analyzer")
 
+    # Fetched once per run and shared by both tabs
+    receipts = get_all_receipts()
+
     tab_vault, tab_analytics = st.tabs(["🩸 Vault & Upload", "📊 Analytics Dashboard"])
 
     # === TAB 1: VAULT & UPLOAD ===
@@ -210,72 +451,65 @@ def main():
             
             if uploaded_file:
                 st.subheader("Image Processing")
-                original_image = None
-                
+                file_bytes = uploaded_file.getvalue()
+                file_hash = hash_bytes(file_bytes)
+                page_count = 1
+
                 if uploaded_file.type == "application/pdf":
+                    # Only rasterize the pages that will actually be OCR'd
+                    page_count = st.number_input("PDF pages to process", min_value=1, value=1, step=1)
                     try:
-                        images = convert_from_bytes(uploaded_file.read())
-                        if images:
-                            original_image = images[0]
-                            st.info("PDF detected: Processed first page as image.")
-                        else:
-                            st.error("Could not convert PDF.")
-                            st.stop()
+                        cleaned_image = preview_cached(file_hash, file_bytes, uploaded_file.type)
                     except Exception as e:
                         st.error(f"Error converting PDF: {e}")
                         st.stop()
+                    if cleaned_image is None:
+                        st.error("Could not convert PDF.")
+                        st.stop()
+                    st.info(f"PDF detected: processing up to {page_count} page(s); showing the first.")
                 else:
-                    original_image = Image.open(uploaded_file)
+                    cleaned_image = preview_cached(file_hash, file_bytes, uploaded_file.type)
 
-                if original_image:
-                    cleaned_image = preprocess_image(original_image)
+                if cleaned_image is not None:
                     st.image(cleaned_image, caption="Processed Image", use_container_width=True)
                     
                     if st.button("🚀 Process & Save to Vault", type="primary", use_container_width=True):
                         with st.spinner(" performing OCR and extracting data..."):
-                            raw_text = extract_text(cleaned_image)
-                            receipt_data = parse_receipt_data(raw_text)
-                            line_items = parse_line_items_data(raw_text)
+                            raw_text, receipt_data, line_items = process_upload_cached(file_hash, file_bytes, uploaded_file.type, page_count)
                             
-                            is_duplicate = check_if_receipt_exists(
-                                receipt_data['merchant'], receipt_data['date'], receipt_data['total']
-                            )
+                            inserted, _ = save_receipt_to_db(receipt_data['merchant'], receipt_data['date'], receipt_data['total'], receipt_data['tax'], uploaded_file.name, line_items, file_hash)
 
-                            if is_duplicate:
+                            if not inserted:
                                 st.error(f"Duplicate Receipt Detected from {receipt_data['merchant']}!")
                             else:
-                                if save_receipt_to_db(receipt_data['merchant'], receipt_data['date'], receipt_data['total'], receipt_data['tax'], uploaded_file.name, line_items):
-                                    st.success("Receipt processed and saved successfully!")
-                                    st.metric("Extracted Tax", f"${receipt_data['tax']:.2f}")
-                                    st.rerun() 
+                                st.success("Receipt processed and saved successfully!")
+                                st.metric("Extracted Tax", f"${receipt_data['tax']:.2f}")
+                                st.rerun() 
 
         with col_storage:
             st.subheader("Persistent Storage")
-            receipts_df = get_all_receipts()
-            st.dataframe(receipts_df, use_container_width=True, hide_index=True)
+            st.dataframe(receipts, use_container_width=True, hide_index=True)
             
             st.divider()
             
             # --- MODIFIED SECTION: DETAILED BILL ITEMS ---
             st.subheader("🔍 Detailed Bill Items & Validation")
-            if not receipts_df.empty:
-                receipt_ids = receipts_df['id'].tolist()
+            if receipts.num_rows:
+                receipt_ids = receipts.column('id').to_pylist()
                 selected_id = st.selectbox("Select ID to view items:", receipt_ids)
                 
                 if selected_id:
-                    items_df = get_detailed_bill_data(selected_id)
+                    items_df = get_bill_items_table(selected_id)
+                    calculated_subtotal = get_subtotal(selected_id)
                     official_total, official_tax = get_receipt_metadata(selected_id)
                     
                     if not items_df.empty:
-                        items_df.insert(0, 'S.No', range(1, 1 + len(items_df)))
-                        items_df['Total Price'] = items_df['Quantity'] * items_df['Unit Price']
                         st.dataframe(items_df, use_container_width=True, hide_index=True)
                         
                         # --- VALIDATION LOGIC ---
                         st.markdown("### 🧾 Mathematical Validation")
                         st.caption("Formula: Subtotal (Sum of Items) + Tax = Official Total")
                         
-                        calculated_subtotal = items_df['Total Price'].sum()
                         calculated_grand_total = calculated_subtotal + official_tax
                         discrepancy = official_total - calculated_grand_total
                         
@@ -311,16 +545,16 @@ def main():
     # === TAB 2: ANALYTICS DASHBOARD ===
     with tab_analytics:
         st.subheader("📊 Spending Insights")
-        df = get_all_receipts()
         
-        if not df.empty:
-            df['total'] = pd.to_numeric(df['total'], errors='coerce').fillna(0)
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        if receipts.num_rows:
+            # Plotly wants pandas; the column is already float64 so only NULLs need filling
+            df = receipts.to_pandas()
+            df['total'] = df['total'].fillna(0)
             
             col_charts_1, col_charts_2 = st.columns(2)
             with col_charts_1:
                 st.markdown("**Spending by Merchant**")
-                fig_pie = px.pie(df, values='total', names='merchant', hole=0.4)
+                fig_pie = px.pie(get_spend_by_merchant(), values='total', names='merchant', hole=0.4)
                 st.plotly_chart(fig_pie, use_container_width=True)
             with col_charts_2:
                 st.markdown("**Tax vs Total Ratio**")
@@ -330,9 +564,7 @@ def main():
                 st.plotly_chart(fig_scat, use_container_width=True)
 
             st.subheader("Spending Over Time")
-            daily_spend = df.groupby('date')['total'].sum().reset_index()
-            daily_spend = daily_spend.sort_values('date')
-            fig_line = px.line(daily_spend, x='date', y='total', markers=True)
+            fig_line = px.line(get_daily_spend(), x='date', y='total', markers=True)
             st.plotly_chart(fig_line, use_container_width=True)
         else:
             st.info("No data available for analysis.")